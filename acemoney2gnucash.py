@@ -1,12 +1,19 @@
 import xml.etree.ElementTree as ET
 import config
 import gnucashxmlwriter
+import snapshot
 import gzip
 import argparse
+import itertools
 import sys
+from collections import namedtuple
 from datetime import datetime
 
 
+Transaction = namedtuple("Transaction", "day, tran_id, category_id, account_id, transfer_account_id, amount, "
+                                        "transfer_amount, reconciled, payee_id, comment")
+
+
 class AccountGroup:
     """ Encapsulates the properties of an AceMoney AccountGroup """
 
@@ -32,7 +39,7 @@ class Account:
 
 
 class Category:
-    """ Encapsulates the properties of an AceMoney Category. Categories form a two-level hierarchy """
+    """ Encapsulates the properties of an AceMoney Category. Categories form a hierarchy of any depth """
 
     def __init__(self, ace_id, parent, name, account_type='EXPENSE'):
         self.ace_id = ace_id
@@ -40,9 +47,65 @@ class Category:
         self.name = name
         self.currency = config.DEFAULT_CURRENCY
         self.account_type = account_type
+        self.children = []
+        self.children_by_name = {}
         self.gnu_id = config.next_id()
 
 
+class CategoryTree:
+    """ Category hierarchy, a trie keyed by the segments of each category path, e.g. ('Car', 'Fuel') """
+
+    def __init__(self):
+        self.roots = []
+        self.roots_by_name = {}
+
+    def add(self, ace_id, path):
+        """ Returns the category at the given path, creating it and any missing intermediate nodes """
+        parent = None
+        siblings, siblings_by_name = self.roots, self.roots_by_name
+        for name in path:
+            category = siblings_by_name.get(name)
+            if category is None:
+                category = Category(None, parent, name)
+                siblings.append(category)
+                siblings_by_name[name] = category
+            parent = category
+            siblings, siblings_by_name = category.children, category.children_by_name
+        parent.ace_id = ace_id
+        return parent
+
+    def walk(self):
+        """ Yields all categories, each parent before its children """
+        stack = list(reversed(self.roots))
+        while stack:
+            category = stack.pop()
+            yield category
+            stack.extend(reversed(category.children))
+
+
+class TransactionTable:
+    """ Column-oriented store of AceMoney transactions. Holds one list per Transaction field """
+
+    def __init__(self, columns=None):
+        self.columns = columns if columns is not None else {name: [] for name in Transaction._fields}
+
+    def __len__(self):
+        return len(self.columns['day'])
+
+    def __iter__(self):
+        return itertools.imap(Transaction, *[self.columns[name] for name in Transaction._fields])
+
+    def append(self, transaction):
+        for name, value in zip(Transaction._fields, transaction):
+            self.columns[name].append(value)
+
+    def sorted_by_day(self):
+        """ Returns a new table with the transactions in chronological order """
+        days = self.columns['day']
+        order = sorted(range(len(days)), key=days.__getitem__)
+        return TransactionTable({name: [column[i] for i in order] for name, column in self.columns.items()})
+
+
 class AceMoneyToGnuCash:
     """ The main converter class. Loads an AceMoney .xml and generates a .gnucash document """
 
@@ -50,98 +113,120 @@ class AceMoneyToGnuCash:
         self.account_groups = {}
         self.accounts = {}
         self.categories = {}
+        self.category_tree = CategoryTree()
         self.payees = {}
-        self.input_tree = None
+        self.transactions = TransactionTable()
         self.processed_transactions_count = 0
 
     def load(self, input_filename):
-        """ Loads an AceMoney .xml, reads payees, account groups, accounts and categories """
-        self.input_tree = ET.parse(input_filename)
+        """ Loads an AceMoney .xml, or its up-to-date snapshot. Builds payees, account groups, accounts,
+        categories and transactions """
+        data = None
+        if config.USE_SNAPSHOTS:
+            # hash the input once, before parsing, so a snapshot never pairs a new digest with old data
+            digest = snapshot.get_digest(input_filename)
+            data = snapshot.load(input_filename, digest)
+        if data is None:
+            data = self.parse(input_filename)
+            if config.USE_SNAPSHOTS:
+                snapshot.save(input_filename, data, digest)
+
+        self.load_payees(data['payees'])
+        self.load_account_groups(data['account_groups'])
+        self.load_accounts(data['accounts'])
+        self.load_categories(data['categories'])
+        self.transactions = TransactionTable(data['transactions'])
+
+    @staticmethod
+    def parse(input_filename):
+        """ Reads the raw records of an AceMoney .xml into a dict of built-in types, suitable for a snapshot """
+        input_tree = ET.parse(input_filename)
         print 'Loaded', input_filename
         print
-        self.load_payees()
-        self.load_account_groups()
-        self.load_accounts()
-        self.load_categories()
-
-    def load_payees(self):
-        payee_elements = self.input_tree.findall('.//Payee')
-        print 'Found', len(payee_elements), 'payees:'
-        for payee in payee_elements:
-            payee_id = payee.find('PayeeID').get('ID')
-            payee_name = payee.get('Name')
+
+        transactions = TransactionTable()
+        for tran in input_tree.findall('.//Transaction'):
+            category_elem = tran.find('CategoryID')
+            payee_elem = tran.find('PayeeID')
+            tran_accounts = tran.findall('AccountID')
+            transactions.append(Transaction(
+                tran.get('Date'),
+                tran.find('TransactionID').get('ID'),
+                -1 if category_elem is None else category_elem.get('ID'),
+                tran_accounts[0].get('ID'),
+                tran_accounts[1].get('ID') if len(tran_accounts) == 2 else None,
+                tran.get('Amount'),
+                tran.get('TransferAmount'),
+                tran.find('TransactionState').get('State') == '1',
+                None if payee_elem is None else payee_elem.get('ID'),
+                tran.get('Comment')))
+
+        return {
+            'payees': [(payee.find('PayeeID').get('ID'), payee.get('Name'))
+                       for payee in input_tree.findall('.//Payee')],
+            'account_groups': [(group.find('AccountGroupID').get('ID'), group.get('Name'))
+                               for group in input_tree.findall('.//AccountGroup')],
+            'accounts': [(account.find('AccountID').get('ID'), account.find('AccountGroupID').get('ID'),
+                          account.get('Name'), account.find('CurrencyID').get('ID'), account.get('InitialBalance'),
+                          account.get('Number'), account.get('Comment'), account.get('IsClosed') == 'TRUE')
+                         for account in input_tree.findall('.//Account')],
+            'categories': [(category.find('CategoryID').get('ID'), category.get('Name'))
+                           for category in input_tree.findall('.//Category')],
+            'transactions': transactions.sorted_by_day().columns,
+        }
+
+    def load_payees(self, payee_records):
+        print 'Found', len(payee_records), 'payees:'
+        for payee_id, payee_name in payee_records:
             self.payees[payee_id] = payee_name
             print(u"Payee ID={0} '{1}'".format(payee_id, payee_name))
         print
 
-    def load_account_groups(self):
-        account_group_elements = self.input_tree.findall('.//AccountGroup')
-        print 'Found', len(account_group_elements), 'account groups:'
-        for group in account_group_elements:
-            group_id = group.find('AccountGroupID').get('ID')
-            group_name = group.get('Name')
+    def load_account_groups(self, group_records):
+        print 'Found', len(group_records), 'account groups:'
+        for group_id, group_name in group_records:
             self.account_groups[group_id] = AccountGroup(group_id, group_name)
             print(u"Group ID={0} '{1}'".format(group_id, group_name))
         print
 
-    def load_accounts(self):
-        account_elements = self.input_tree.findall('.//Account')
-        print 'Found', len(account_elements), 'accounts:'
-        for account in account_elements:
-            currency_code = config.ACE_CURRENCY_CODES[account.find('CurrencyID').get('ID')]
-            group = self.account_groups[account.find('AccountGroupID').get('ID')]
-            account_id = account.find('AccountID').get('ID')
-            account_name = account.get('Name')
-            account_balance = account.get('InitialBalance')
-
+    def load_accounts(self, account_records):
+        print 'Found', len(account_records), 'accounts:'
+        for account_id, group_id, account_name, currency_id, account_balance, number, comment, hidden \
+                in account_records:
+            currency_code = config.ACE_CURRENCY_CODES[currency_id]
+            group = self.account_groups[group_id]
             self.accounts[account_id] = Account(account_id, group, account_name, currency_code,
-                                                account_balance, account.get('Number'), account.get('Comment'),
-                                                account.get('IsClosed') == 'TRUE')
+                                                account_balance, number, comment, hidden)
             print(u"Account ID={0} '{1} / {2}'".format(account_id, group.name, account_name))
         print
 
-    def load_categories(self):
-        categories_by_name = {}
-
-        category_elements = self.input_tree.findall('.//Category')
-        print 'Found', len(category_elements), 'categories:'
-        for category in category_elements:
-            category_id = category.find('CategoryID').get('ID')
-            category_name = category.get('Name')
-            if ':' not in category_name:
-                print(u"TopCategory ID={0} '{1}'".format(category_id, category_name))
-                account_type = 'INCOME' if category_id in config.ACE_INCOME_CATEGORY_IDS else 'EXPENSE'
-                ace_category = Category(category_id, None, category_name, account_type)
-                self.categories[category_id] = ace_category
-                categories_by_name[category_name] = ace_category
-
-        for category in category_elements:
-            category_id = category.find('CategoryID').get('ID')
-            category_name = category.get('Name')
-
-            split = category_name.split(':')
-            if len(split) == 2:
-                print(u"Category ID={0} '{1}'".format(category_id, category_name))
-                parent = categories_by_name[split[0]]
-                category_name = split[1]
-                account_type = 'INCOME' if category_id in config.ACE_INCOME_CATEGORY_IDS else parent.account_type
-                self.categories[category_id] = Category(category_id, parent, category_name, account_type)
+    def load_categories(self, category_records):
+        print 'Found', len(category_records), 'categories:'
+        for category_id, category_name in category_records:
+            print(u"Category ID={0} '{1}'".format(category_id, category_name))
+            self.categories[category_id] = self.category_tree.add(category_id, tuple(category_name.split(':')))
+
+        # resolve account types top-down; sub-categories inherit the type of their parent
+        for category in self.category_tree.walk():
+            if category.ace_id in config.ACE_INCOME_CATEGORY_IDS:
+                category.account_type = 'INCOME'
+            elif category.parent is not None:
+                category.account_type = category.parent.account_type
 
         default_category = Category(-1, None, 'Unassigned')
+        self.category_tree.roots.append(default_category)
         self.categories[-1] = default_category
         print
 
     def get_payee_name(self, transaction):
-        payee_elem = transaction.find('PayeeID')
         tran_payee = None
-        if payee_elem is not None:
-            tran_payee = self.payees[payee_elem.get('ID')]
+        if transaction.payee_id is not None:
+            tran_payee = self.payees[transaction.payee_id]
         return tran_payee
 
     def write(self, output_filename):
-        """ Loads and processes all transactions. Generates the output file """
-        transactions = self.get_sorted_transactions()
-        print 'Found', len(transactions), 'transactions'
+        """ Processes all transactions. Generates the output file """
+        print 'Found', len(self.transactions), 'transactions'
 
         writer = gnucashxmlwriter.GnuCashXmlWriter()
         writer.load_skeleton('skeleton.gnucash')
@@ -150,49 +235,37 @@ class AceMoneyToGnuCash:
         writer.write_root_account()
         writer.write_opening_balance_accounts()
         writer.write_trading_accounts()
-        writer.write_ace_categories(self.categories.values())
+        writer.write_ace_categories(self.category_tree.walk())
         writer.write_ace_account_groups(self.account_groups.values())
         writer.write_ace_accounts(self.accounts.values())
-        for tran in transactions:
+        for tran in self.transactions:
             self.export_transaction(writer, tran)
         writer.save(output_filename)
 
-    def get_sorted_transactions(self):
-        sorted_pairs = []
-        for tran in self.input_tree.findall('.//Transaction'):
-            sorted_pairs.append((tran.get('Date'), tran))
-        sorted_pairs.sort()
-        return [item[-1] for item in sorted_pairs]
-
     def export_transaction(self, writer, tran):
         if self.processed_transactions_count % 100 == 0:
             sys.stdout.write('.')
         self.processed_transactions_count += 1
 
-        tran_day = tran.get('Date')
-        tran_id = tran.find('TransactionID').get('ID')
+        tran_day = tran.day
+        tran_id = tran.tran_id
+        tran_cat_id = tran.category_id
 
-        if tran.find('CategoryID') is None:
-            tran_cat_id = -1
-        else:
-            tran_cat_id = tran.find('CategoryID').get('ID')
-
-        tran_accounts = tran.findall('AccountID')
-        if len(tran_accounts) == 2:
-            account_src = self.accounts[tran_accounts[1].get('ID')]
-            account_dst = self.accounts[tran_accounts[0].get('ID')]
-            amount_src = tran.get('TransferAmount')
-            amount_dst = tran.get('Amount')
+        if tran.transfer_account_id is not None:
+            account_src = self.accounts[tran.transfer_account_id]
+            account_dst = self.accounts[tran.account_id]
+            amount_src = tran.transfer_amount
+            amount_dst = tran.amount
         else:
-            account_src = self.accounts[tran_accounts[0].get('ID')]
+            account_src = self.accounts[tran.account_id]
             account_dst = self.categories[tran_cat_id]
-            amount_src = tran.get('Amount')
+            amount_src = tran.amount
             day = datetime.strptime(tran_day, '%Y-%m-%d').date()
             amount_dst = str(float(amount_src) * config.get_fx_rate(account_src.currency, day))
 
         # Limitations - 'cleared' state is ignored; The flag for the second transaction leg (if present) is ignored
-        reconciled = tran.find('TransactionState').get('State') == '1'
-        description = config.concat(self.get_payee_name(tran), tran.get('Comment'), ': ')
+        reconciled = tran.reconciled
+        description = config.concat(self.get_payee_name(tran), tran.comment, ': ')
 
         if tran_cat_id in config.ACE_OPENING_BALANCE_CATEGORY_IDS:
             writer.write_opening_transaction(account_src, amount_src, tran_day, description, tran_id, reconciled)
@@ -12,6 +12,7 @@ ACE_OPENING_BALANCE_CATEGORY_IDS = ('136',)
 OPENING_BALANCE_DAY = date(2000, 1, 1)
 FX_RATES_FILENAME = 'fxrates.xml'
 DEBUG = False
+USE_SNAPSHOTS = True  # cache the parsed input next to it, see snapshot.py
 
 fx_rates_map = {}  # key is (currency, day); value is fx-rate, a float
 
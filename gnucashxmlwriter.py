@@ -188,16 +188,15 @@ class GnuCashXmlWriter:
         income_account_id = config.next_id()
         self.write_account('Income', income_account_id, self.root_account_id, 'INCOME', slots=self.placeholder)
 
-        # first pass: top-level categories
-        for category in categories:
-            if category.parent is None:
-                parent_account_id = expenses_account_id if category.account_type == 'EXPENSE' else income_account_id
-                self.write_account(category.name, category.gnu_id, parent_account_id, category.account_type)
-
-        # second pass: lower-level categories
+        # categories arrive parents-first, so each parent account is written before its children
         for category in categories:
             if category.parent is not None:
-                self.write_account(category.name, category.gnu_id, category.parent.gnu_id, category.account_type)
+                parent_account_id = category.parent.gnu_id
+            elif category.account_type == 'EXPENSE':
+                parent_account_id = expenses_account_id
+            else:
+                parent_account_id = income_account_id
+            self.write_account(category.name, category.gnu_id, parent_account_id, category.account_type)
 
     def write_fx_rates(self):
         config.init_fx_rates()
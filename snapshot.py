@@ -0,0 +1,79 @@
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import zlib
+
+
+# header layout: magic, format version, SHA-1 digest of the input file
+MAGIC = 'ACESNAP'
+VERSION = 2
+HEADER = struct.Struct('<7sH20s')
+FILENAME_SUFFIX = '.snapshot'
+
+
+def get_filename(input_filename):
+    return input_filename + FILENAME_SUFFIX
+
+
+def get_digest(input_filename):
+    """ Returns the SHA-1 digest of the given file's contents """
+    digest = hashlib.sha1()
+    with open(input_filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def load(input_filename, digest):
+    """ Returns the data saved for the input file with the given digest, or None if there is no usable snapshot """
+    snapshot_filename = get_filename(input_filename)
+    if not os.path.exists(snapshot_filename) or os.path.getsize(snapshot_filename) < HEADER.size:
+        return None
+
+    with open(snapshot_filename, 'rb') as f:
+        snapshot_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, snapshot_digest = HEADER.unpack_from(snapshot_map)
+            if magic != MAGIC or version != VERSION or snapshot_digest != digest:
+                print 'Ignoring stale snapshot', snapshot_filename
+                return None
+            # marshal only reads back plain values, never runs code. a damaged payload is treated as stale
+            data = marshal.loads(zlib.decompress(buffer(snapshot_map, HEADER.size)))
+        except (zlib.error, ValueError, EOFError, TypeError):
+            print 'Ignoring stale snapshot', snapshot_filename
+            return None
+        finally:
+            snapshot_map.close()
+
+    print 'Loaded', snapshot_filename
+    print
+    return data
+
+
+def save(input_filename, data, digest):
+    """ Saves the data, which must consist of built-in types only, as a snapshot of the given input file.
+    Failures are reported but never fatal, as the snapshot is only a cache """
+    snapshot_filename = get_filename(input_filename)
+    temp_filename = snapshot_filename + '.tmp'
+    try:
+        with open(temp_filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, digest))
+            f.write(zlib.compress(marshal.dumps(data)))
+        # os.rename does not replace an existing file on Windows
+        if os.path.exists(snapshot_filename):
+            os.remove(snapshot_filename)
+        os.rename(temp_filename, snapshot_filename)
+    except (IOError, OSError) as e:
+        print 'Warning: could not save', snapshot_filename, '-', e
+        if os.path.exists(temp_filename):
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+        print
+        return
+
+    print 'Saved', snapshot_filename
+    print